@@ -5,31 +5,24 @@ Defines tools for creating and editing presentations,
 and provides the main agent streaming function.
 """
 
-import uuid
+import asyncio
+import json
+import re
+import secrets
 import logging
+from functools import partial
 from typing import Any, AsyncGenerator, Optional
-from contextvars import ContextVar
 
 from models import Presentation, Slide, SlideLayout, PendingEdit
 from session import PresentationSession, session_manager
 
 logger = logging.getLogger(__name__)
 
-# Context variable for current session (async-safe)
-_current_session: ContextVar[Optional[PresentationSession]] = ContextVar(
-    "current_session", default=None
-)
-
-
-def get_current_session() -> Optional[PresentationSession]:
-    """Get the current session from context."""
-    return _current_session.get()
-
-
-def set_current_session(session: Optional[PresentationSession]):
-    """Set the current session in context."""
-    _current_session.set(session)
+# Matches any HTML tag; used to strip markup from slide previews
+_TAG_RE = re.compile(r"<[^>]+>")
 
+# Layout value -> SlideLayout; unknown values fall back to BLANK
+_LAYOUTS = {layout.value: layout for layout in SlideLayout}
 
 # Try to import Claude Agent SDK
 try:
@@ -66,17 +59,26 @@ except ImportError as e:
     ToolResultBlock = None
     print(f"[Agent] WARNING: Claude Agent SDK not available: {e}")
 
-# Fallback tool decorator when SDK not available
-if not AGENT_SDK_AVAILABLE:
 
-    def tool(name: str, description: str, params: dict):
-        def decorator(func):
-            func._tool_name = name
-            func._tool_description = description
-            func._tool_params = params
-            return func
+def _tool_spec(name: str, description: str, params: dict):
+    """Record MCP tool metadata on a session-bound tool body.
+
+    Tool bodies take ``(session, args)``; _build_tools() binds them to a
+    session and registers them with the SDK ``tool`` decorator.
+    """
+
+    def decorator(func):
+        func._tool_name = name
+        func._tool_description = description
+        func._tool_params = params
+        return func
 
-        return decorator
+    return decorator
+
+
+# Fallback tool decorator when SDK not available
+if not AGENT_SDK_AVAILABLE:
+    tool = _tool_spec
 
 
 # =============================================================================
@@ -84,24 +86,21 @@ if not AGENT_SDK_AVAILABLE:
 # =============================================================================
 
 
-@tool("create_presentation", "Create a new presentation", {"title": str})
-async def tool_create_presentation(args: dict[str, Any]) -> dict[str, Any]:
+@_tool_spec("create_presentation", "Create a new presentation", {"title": str})
+def tool_create_presentation(
+    session: PresentationSession, args: dict[str, Any]
+) -> dict[str, Any]:
     """Create a new presentation with the given title."""
-    session = get_current_session()
-    if not session:
-        logger.error("create_presentation called with no active session")
-        return {"error": "No active session"}
-
     title = args.get("title", "Untitled Presentation")
     session.presentation = Presentation(title=title)
-    session.pending_edits = []
+    session.pending_edits.clear()
     session.applied_edits = []
 
     logger.info(f"Created presentation: '{title}'")
     return {"success": True, "title": title, "slide_count": 0}
 
 
-@tool(
+@_tool_spec(
     "add_slide",
     "Add a new slide with HTML content",
     {
@@ -110,12 +109,10 @@ async def tool_create_presentation(args: dict[str, Any]) -> dict[str, Any]:
         "layout": str,  # Optional - defaults to "blank"
     },
 )
-async def tool_add_slide(args: dict[str, Any]) -> dict[str, Any]:
+def tool_add_slide(
+    session: PresentationSession, args: dict[str, Any]
+) -> dict[str, Any]:
     """Add a new slide to the presentation."""
-    session = get_current_session()
-    if not session:
-        logger.error("add_slide called with no active session")
-        return {"error": "No active session"}
     if not session.presentation:
         logger.error(
             "add_slide called but no presentation exists - agent should call create_presentation first"
@@ -124,27 +121,19 @@ async def tool_add_slide(args: dict[str, Any]) -> dict[str, Any]:
 
     html = args.get("html", "")
     position = args.get("position")
-    layout_str = args.get("layout", "blank")
-
-    try:
-        layout = SlideLayout(layout_str)
-    except ValueError:
-        layout = SlideLayout.BLANK
+    layout = _LAYOUTS.get(args.get("layout", "blank"), SlideLayout.BLANK)
 
     # Count pending ADD edits to calculate correct index
     # This ensures slides added in quick succession get correct sequential indices
     pending_add_count = sum(1 for e in session.pending_edits if e.operation == "ADD")
-    current_slide_count = len(session.presentation.slides)
+    end_index = len(session.presentation.slides) + pending_add_count
 
-    # Determine position
-    if position is None or position >= (current_slide_count + pending_add_count):
-        index = current_slide_count + pending_add_count
-    else:
-        index = max(0, position)
+    # Determine position: default to the end, clamp anything else into range
+    index = end_index if position is None else min(end_index, max(0, position))
 
     # Create pending edit
     edit = PendingEdit(
-        edit_id=str(uuid.uuid4()),
+        edit_id=secrets.token_hex(8),
         slide_index=index,
         operation="ADD",
         params={"html": html, "layout": layout.value},
@@ -156,16 +145,15 @@ async def tool_add_slide(args: dict[str, Any]) -> dict[str, Any]:
     return {"success": True, "slide_index": index, "edit_id": edit.edit_id}
 
 
-@tool(
+@_tool_spec(
     "update_slide",
     "Update an existing slide's HTML content",
     {"slide_index": int, "html": str},
 )
-async def tool_update_slide(args: dict[str, Any]) -> dict[str, Any]:
+def tool_update_slide(
+    session: PresentationSession, args: dict[str, Any]
+) -> dict[str, Any]:
     """Update the content of an existing slide."""
-    session = get_current_session()
-    if not session:
-        return {"error": "No active session"}
     if not session.presentation:
         return {"error": "No presentation loaded"}
 
@@ -176,7 +164,7 @@ async def tool_update_slide(args: dict[str, Any]) -> dict[str, Any]:
         return {"error": f"Invalid slide index: {slide_index}"}
 
     edit = PendingEdit(
-        edit_id=str(uuid.uuid4()),
+        edit_id=secrets.token_hex(8),
         slide_index=slide_index,
         operation="UPDATE",
         params={"html": html},
@@ -187,12 +175,15 @@ async def tool_update_slide(args: dict[str, Any]) -> dict[str, Any]:
     return {"success": True, "slide_index": slide_index, "edit_id": edit.edit_id}
 
 
-@tool("delete_slide", "Delete a slide from the presentation", {"slide_index": int})
-async def tool_delete_slide(args: dict[str, Any]) -> dict[str, Any]:
+@_tool_spec(
+    "delete_slide",
+    "Delete a slide from the presentation",
+    {"slide_index": int},
+)
+def tool_delete_slide(
+    session: PresentationSession, args: dict[str, Any]
+) -> dict[str, Any]:
     """Delete a slide from the presentation."""
-    session = get_current_session()
-    if not session:
-        return {"error": "No active session"}
     if not session.presentation:
         return {"error": "No presentation loaded"}
 
@@ -202,7 +193,7 @@ async def tool_delete_slide(args: dict[str, Any]) -> dict[str, Any]:
         return {"error": f"Invalid slide index: {slide_index}"}
 
     edit = PendingEdit(
-        edit_id=str(uuid.uuid4()),
+        edit_id=secrets.token_hex(8),
         slide_index=slide_index,
         operation="DELETE",
         params={},
@@ -213,16 +204,15 @@ async def tool_delete_slide(args: dict[str, Any]) -> dict[str, Any]:
     return {"success": True, "slide_index": slide_index, "edit_id": edit.edit_id}
 
 
-@tool(
+@_tool_spec(
     "reorder_slides",
     "Move a slide to a new position",
     {"from_index": int, "to_index": int},
 )
-async def tool_reorder_slides(args: dict[str, Any]) -> dict[str, Any]:
+def tool_reorder_slides(
+    session: PresentationSession, args: dict[str, Any]
+) -> dict[str, Any]:
     """Reorder slides in the presentation."""
-    session = get_current_session()
-    if not session:
-        return {"error": "No active session"}
     if not session.presentation:
         return {"error": "No presentation loaded"}
 
@@ -230,13 +220,13 @@ async def tool_reorder_slides(args: dict[str, Any]) -> dict[str, Any]:
     to_index = args.get("to_index", 0)
     num_slides = len(session.presentation.slides)
 
-    if from_index < 0 or from_index >= num_slides:
-        return {"error": f"Invalid from_index: {from_index}"}
-    if to_index < 0 or to_index >= num_slides:
-        return {"error": f"Invalid to_index: {to_index}"}
+    if not (0 <= from_index < num_slides and 0 <= to_index < num_slides):
+        return {
+            "error": f"Invalid slide indices: from_index={from_index}, to_index={to_index}"
+        }
 
     edit = PendingEdit(
-        edit_id=str(uuid.uuid4()),
+        edit_id=secrets.token_hex(8),
         slide_index=from_index,
         operation="REORDER",
         params={"to_index": to_index},
@@ -247,29 +237,30 @@ async def tool_reorder_slides(args: dict[str, Any]) -> dict[str, Any]:
     return {"success": True, "from_index": from_index, "to_index": to_index}
 
 
-@tool("list_slides", "List all slides in the presentation", {})
-async def tool_list_slides(args: dict[str, Any]) -> dict[str, Any]:
+def _html_preview(html: str, limit: int = 100) -> str:
+    """Build a short plain-text preview of slide HTML.
+
+    Tags are replaced by a single space in one regex pass and whitespace is
+    collapsed by split/join, so only two intermediate strings are created.
+    """
+    return " ".join(_TAG_RE.sub(" ", html[:200]).split())[:limit]
+
+
+@_tool_spec("list_slides", "List all slides in the presentation", {})
+def tool_list_slides(
+    session: PresentationSession, args: dict[str, Any]
+) -> dict[str, Any]:
     """List all slides with their index and content preview."""
-    session = get_current_session()
-    if not session:
-        return {"error": "No active session"}
     if not session.presentation:
         return {"slides": [], "count": 0}
 
-    import re
-
     slides = []
     for slide in session.presentation.slides:
-        # Create a preview by stripping HTML and truncating
-        preview = slide.html[:200].replace("<", " <").replace(">", "> ")
-        preview = re.sub(r"<[^>]+>", "", preview).strip()
-        preview = " ".join(preview.split())[:100]
-
         slides.append(
             {
                 "index": slide.index,
                 "layout": slide.layout.value,
-                "preview": preview,
+                "preview": _html_preview(slide.html),
                 "has_notes": bool(slide.notes),
             }
         )
@@ -277,12 +268,11 @@ async def tool_list_slides(args: dict[str, Any]) -> dict[str, Any]:
     return {"slides": slides, "count": len(slides)}
 
 
-@tool("get_slide", "Get full details of a specific slide", {"slide_index": int})
-async def tool_get_slide(args: dict[str, Any]) -> dict[str, Any]:
+@_tool_spec("get_slide", "Get full details of a specific slide", {"slide_index": int})
+def tool_get_slide(
+    session: PresentationSession, args: dict[str, Any]
+) -> dict[str, Any]:
     """Get the full HTML content and details of a slide."""
-    session = get_current_session()
-    if not session:
-        return {"error": "No active session"}
     if not session.presentation:
         return {"error": "No presentation loaded"}
 
@@ -300,12 +290,11 @@ async def tool_get_slide(args: dict[str, Any]) -> dict[str, Any]:
     }
 
 
-@tool("set_theme", "Set the presentation theme (colors, fonts)", {"theme": dict})
-async def tool_set_theme(args: dict[str, Any]) -> dict[str, Any]:
+@_tool_spec("set_theme", "Set the presentation theme (colors, fonts)", {"theme": dict})
+def tool_set_theme(
+    session: PresentationSession, args: dict[str, Any]
+) -> dict[str, Any]:
     """Set the presentation theme."""
-    session = get_current_session()
-    if not session:
-        return {"error": "No active session"}
     if not session.presentation:
         return {"error": "No presentation created"}
 
@@ -315,13 +304,15 @@ async def tool_set_theme(args: dict[str, Any]) -> dict[str, Any]:
     return {"success": True, "theme": theme}
 
 
-@tool("get_pending_edits", "Get all pending edits that haven't been committed", {})
-async def tool_get_pending_edits(args: dict[str, Any]) -> dict[str, Any]:
+@_tool_spec(
+    "get_pending_edits",
+    "Get all pending edits that haven't been committed",
+    {},
+)
+def tool_get_pending_edits(
+    session: PresentationSession, args: dict[str, Any]
+) -> dict[str, Any]:
     """Get all pending edits."""
-    session = get_current_session()
-    if not session:
-        return {"error": "No active session"}
-
     edits = [
         {
             "edit_id": e.edit_id,
@@ -335,70 +326,92 @@ async def tool_get_pending_edits(args: dict[str, Any]) -> dict[str, Any]:
     return {"edits": edits, "count": len(edits)}
 
 
-@tool("commit_edits", "Apply all pending edits to the presentation", {})
-async def tool_commit_edits(args: dict[str, Any]) -> dict[str, Any]:
+@_tool_spec("commit_edits", "Apply all pending edits to the presentation", {})
+async def tool_commit_edits(
+    session: PresentationSession, args: dict[str, Any]
+) -> dict[str, Any]:
     """Apply all pending edits."""
-    session = get_current_session()
-    if not session:
-        logger.error("commit_edits called with no active session")
-        return {"error": "No active session"}
     if not session.presentation:
         logger.error("commit_edits called but no presentation exists")
         return {"error": "No presentation created"}
 
-    applied_count = 0
-
-    for edit in session.pending_edits:
-        try:
-            if edit.operation == "ADD":
-                # Add new slide
-                slide = Slide(
-                    index=edit.slide_index,
-                    html=edit.params.get("html", ""),
-                    layout=SlideLayout(edit.params.get("layout", "blank")),
-                )
-                # Insert at position
-                if edit.slide_index >= len(session.presentation.slides):
-                    session.presentation.slides.append(slide)
-                else:
-                    session.presentation.slides.insert(edit.slide_index, slide)
-                # Re-index all slides
-                for i, s in enumerate(session.presentation.slides):
-                    s.index = i
-
-            elif edit.operation == "UPDATE":
-                if 0 <= edit.slide_index < len(session.presentation.slides):
-                    session.presentation.slides[edit.slide_index].html = (
-                        edit.params.get("html", "")
+    # The previous background save must finish before the slides change again
+    await _await_pending_save(session)
+
+    async with session._pending_lock:
+        applied_count = 0
+        needs_reindex = False
+
+        # Drain edits in order; the queue is left empty when done
+        while session.pending_edits:
+            edit = session.pending_edits.popleft()
+            batch = [edit]
+            if edit.operation in ("ADD", "DELETE", "REORDER"):
+                needs_reindex = True
+            try:
+                if edit.operation == "ADD":
+                    # ADDs at consecutive indices (e.g. parallel add_slide
+                    # calls) form one contiguous block, so insert them with a
+                    # single slice assignment instead of one insert each
+                    while session.pending_edits:
+                        nxt = session.pending_edits[0]
+                        if (
+                            nxt.operation != "ADD"
+                            or nxt.slide_index != batch[-1].slide_index + 1
+                        ):
+                            break
+                        batch.append(session.pending_edits.popleft())
+
+                    new_slides = [
+                        Slide(
+                            index=e.slide_index,
+                            html=e.params.get("html", ""),
+                            layout=_LAYOUTS.get(
+                                e.params.get("layout", "blank"), SlideLayout.BLANK
+                            ),
+                        )
+                        for e in batch
+                    ]
+                    # Slicing past the end appends, matching list.insert
+                    session.presentation.slides[edit.slide_index : edit.slide_index] = (
+                        new_slides
                     )
 
-            elif edit.operation == "DELETE":
-                if 0 <= edit.slide_index < len(session.presentation.slides):
-                    del session.presentation.slides[edit.slide_index]
-                    # Re-index
-                    for i, s in enumerate(session.presentation.slides):
-                        s.index = i
-
-            elif edit.operation == "REORDER":
-                to_index = edit.params.get("to_index", 0)
-                if 0 <= edit.slide_index < len(session.presentation.slides):
-                    slide = session.presentation.slides.pop(edit.slide_index)
-                    session.presentation.slides.insert(to_index, slide)
-                    # Re-index
-                    for i, s in enumerate(session.presentation.slides):
-                        s.index = i
-
-            session.applied_edits.append(edit.to_dict())
-            applied_count += 1
-
-        except Exception as e:
-            logger.error(f"Error applying edit {edit.edit_id}: {e}")
-
-    # Clear pending edits
-    session.pending_edits = []
+                elif edit.operation == "UPDATE":
+                    if 0 <= edit.slide_index < len(session.presentation.slides):
+                        session.presentation.slides[edit.slide_index].html = (
+                            edit.params.get("html", "")
+                        )
 
-    # Save session
-    session_manager.save_session(session)
+                elif edit.operation == "DELETE":
+                    if 0 <= edit.slide_index < len(session.presentation.slides):
+                        del session.presentation.slides[edit.slide_index]
+
+                elif edit.operation == "REORDER":
+                    to_index = edit.params.get("to_index", 0)
+                    if 0 <= edit.slide_index < len(session.presentation.slides):
+                        slide = session.presentation.slides.pop(edit.slide_index)
+                        session.presentation.slides.insert(to_index, slide)
+
+                session.applied_edits.extend(e.to_dict() for e in batch)
+                applied_count += len(batch)
+
+            except Exception as e:
+                logger.error(f"Error applying edit {edit.edit_id}: {e}")
+
+        # Re-index once for the whole batch if any edit changed slide positions
+        if needs_reindex:
+            for i, s in enumerate(session.presentation.slides):
+                s.index = i
+
+        # Snapshot here, then only the file/SQLite write runs in a thread so
+        # the tool result goes straight back to the agent. A concurrent commit
+        # may have started a save while this one waited for the lock.
+        snapshot = session_manager.snapshot_session(session)
+        await _await_pending_save(session)
+        session._save_task = asyncio.create_task(
+            asyncio.to_thread(session_manager.write_snapshot, snapshot)
+        )
 
     logger.info(
         f"Committed {applied_count} edits, total slides: {len(session.presentation.slides)}"
@@ -410,6 +423,18 @@ async def tool_commit_edits(args: dict[str, Any]) -> dict[str, Any]:
     }
 
 
+async def _await_pending_save(session: PresentationSession) -> None:
+    """Wait for a background save started by commit_edits, logging failures."""
+    task = session._save_task
+    if task is None:
+        return
+    session._save_task = None
+    try:
+        await task
+    except Exception as e:
+        logger.error(f"Background save failed for session {session.session_id}: {e}")
+
+
 # =============================================================================
 # TOOL REGISTRATION
 # =============================================================================
@@ -427,12 +452,48 @@ PRESENTATION_TOOLS = [
     tool_commit_edits,
 ]
 
+# Fully-qualified MCP tool names the agent may call; built once at import
+_ALLOWED_TOOLS = [
+    f"mcp__presentation__{func._tool_name}" for func in PRESENTATION_TOOLS
+]
+
 # Tool name to function mapping for fallback mode
 TOOL_MAP = {
     func._tool_name: func for func in PRESENTATION_TOOLS if hasattr(func, "_tool_name")
 }
 
 
+def _build_tools(session: PresentationSession) -> list:
+    """Create SDK tools bound to ``session``.
+
+    Each handler closes over the session, so tool calls reach it directly
+    instead of looking it up per call.
+    """
+    return [
+        tool(func._tool_name, func._tool_description, func._tool_params)(
+            _bind_session(func, session)
+        )
+        for func in PRESENTATION_TOOLS
+    ]
+
+
+def _bind_session(func, session: PresentationSession):
+    """Adapt a tool body to the async ``handler(args)`` the SDK awaits.
+
+    Most tool bodies do no I/O and are plain functions; they run under the
+    session's pending-edit lock so they can't interleave with an async tool
+    (commit_edits) that holds it.
+    """
+    if asyncio.iscoroutinefunction(func):
+        return partial(func, session)
+
+    async def handler(args: dict[str, Any]) -> dict[str, Any]:
+        async with session._pending_lock:
+            return func(session, args)
+
+    return handler
+
+
 # =============================================================================
 # SYSTEM PROMPTS
 # =============================================================================
@@ -658,6 +719,52 @@ def _extract_slide_content_from_html(html: str) -> str:
     return None
 
 
+def _describe_add_slide(tool_input: dict) -> tuple[str, str]:
+    html = tool_input.get("html", "")
+    slide_title = _extract_slide_title_from_html(html)
+    slide_content = _extract_slide_content_from_html(html)
+    friendly = (
+        f"Adding slide: {slide_title}" if slide_title else "Adding a new slide..."
+    )
+    return friendly, slide_content
+
+
+def _describe_update_slide(tool_input: dict) -> tuple[str, str]:
+    idx = tool_input.get("slide_index", 0)
+    html = tool_input.get("html", "")
+    slide_title = _extract_slide_title_from_html(html)
+    slide_content = _extract_slide_content_from_html(html)
+    friendly = (
+        f"Updating slide {idx + 1}: {slide_title}"
+        if slide_title
+        else f"Updating slide {idx + 1}..."
+    )
+    return friendly, slide_content
+
+
+# Tool name -> (tool_input -> (friendly_description, details_content))
+_FRIENDLY_DESCRIPTIONS = {
+    "create_presentation": lambda i: (
+        f"Creating presentation: {i.get('title', 'Untitled')}",
+        None,
+    ),
+    "add_slide": _describe_add_slide,
+    "update_slide": _describe_update_slide,
+    "delete_slide": lambda i: (f"Deleting slide {i.get('slide_index', 0) + 1}", None),
+    "list_slides": lambda i: ("Listing all slides...", None),
+    "get_slide": lambda i: (
+        f"Getting slide {i.get('slide_index', 0) + 1} details...",
+        None,
+    ),
+    "commit_edits": lambda i: ("Saving changes...", None),
+    "set_theme": lambda i: ("Setting presentation theme...", None),
+}
+# Also key the fully-qualified MCP names the SDK reports in ToolUseBlocks
+_FRIENDLY_DESCRIPTIONS.update(
+    {f"mcp__presentation__{name}": fn for name, fn in _FRIENDLY_DESCRIPTIONS.items()}
+)
+
+
 def _get_friendly_tool_description(tool_name: str, tool_input: dict) -> tuple[str, str]:
     """Convert a tool call into a user-friendly description and details.
 
@@ -667,126 +774,163 @@ def _get_friendly_tool_description(tool_name: str, tool_input: dict) -> tuple[st
     if not isinstance(tool_input, dict):
         return None, None
 
-    if "create_presentation" in tool_name:
-        title = tool_input.get("title", "Untitled")
-        return f"Creating presentation: {title}", None
-    elif "add_slide" in tool_name:
-        html = tool_input.get("html", "")
-        slide_title = _extract_slide_title_from_html(html)
-        slide_content = _extract_slide_content_from_html(html)
-        friendly = (
-            f"Adding slide: {slide_title}" if slide_title else "Adding a new slide..."
-        )
-        return friendly, slide_content
-    elif "update_slide" in tool_name:
-        idx = tool_input.get("slide_index", 0)
-        html = tool_input.get("html", "")
-        slide_title = _extract_slide_title_from_html(html)
-        slide_content = _extract_slide_content_from_html(html)
-        friendly = (
-            f"Updating slide {idx + 1}: {slide_title}"
-            if slide_title
-            else f"Updating slide {idx + 1}..."
+    describe = _FRIENDLY_DESCRIPTIONS.get(tool_name)
+    if describe is None:
+        return None, None
+    return describe(tool_input)
+
+
+def _truncate(value: Any, limit: int) -> str:
+    """Render ``value`` as text capped at ``limit`` characters.
+
+    Strings are sliced without an extra str() copy and dicts go through the
+    C JSON encoder; anything else falls back to str().
+    """
+    if isinstance(value, str):
+        return value[:limit]
+    if isinstance(value, dict):
+        return json.dumps(value, default=str)[:limit]
+    return str(value)[:limit]
+
+
+def _compact_tool_input(tool_input: dict, max_val: int = 300) -> dict:
+    """Shallow-copy a tool input with long string values cut to ``max_val``.
+
+    Slide HTML can be many KB per call; the stream only needs a preview since
+    friendly/details already carry the readable content.
+    """
+    return {
+        k: (
+            f"{v[:max_val]}...<+{len(v) - max_val}>"
+            if isinstance(v, str) and len(v) > max_val
+            else v
         )
-        return friendly, slide_content
-    elif "delete_slide" in tool_name:
-        idx = tool_input.get("slide_index", 0)
-        return f"Deleting slide {idx + 1}", None
-    elif "list_slides" in tool_name:
-        return "Listing all slides...", None
-    elif "get_slide" in tool_name:
-        idx = tool_input.get("slide_index", 0)
-        return f"Getting slide {idx + 1} details...", None
-    elif "commit_edits" in tool_name:
-        return "Saving changes...", None
-    elif "set_theme" in tool_name:
-        return "Setting presentation theme...", None
-
-    return None, None
+        for k, v in tool_input.items()
+    }
 
 
-def _serialize_message(message) -> dict:
-    """Convert an agent message to a JSON-serializable dict."""
-    msg_dict = {"type": "unknown"}
+def _serialize_assistant(message) -> dict:
+    """Serialize an AssistantMessage (text and/or tool calls)."""
+    msg_dict = {"type": "assistant"}
+    # Single text block (the common case) stays a plain str; only
+    # multi-block messages build a list to join
+    text_acc = None
+    tool_uses = []
+
+    for block in message.content:
+        if TextBlock and isinstance(block, TextBlock):
+            if text_acc is None:
+                text_acc = block.text
+            elif isinstance(text_acc, str):
+                text_acc = [text_acc, block.text]
+            else:
+                text_acc.append(block.text)
+        elif ToolUseBlock and isinstance(block, ToolUseBlock):
+            tool_uses.append(
+                (getattr(block, "name", "unknown"), getattr(block, "input", {}))
+            )
 
-    if AssistantMessage and isinstance(message, AssistantMessage):
-        msg_dict["type"] = "assistant"
-        texts = []
+    if text_acc is not None:
+        msg_dict["text"] = text_acc if isinstance(text_acc, str) else " ".join(text_acc)
+    if tool_uses:
+        # Describe tool calls only once we know the message carries some, and
+        # collect the friendly/details lists in the same pass
         tool_calls = []
+        friendly_msgs = []
+        details_msgs = []
+        for tool_name, tool_input in tool_uses:
+            friendly_desc, details = _get_friendly_tool_description(
+                tool_name, tool_input
+            )
+            tool_calls.append(
+                {
+                    "name": tool_name,
+                    "input": (
+                        _compact_tool_input(tool_input)
+                        if isinstance(tool_input, dict)
+                        else _truncate(tool_input, 200)
+                    ),
+                    "friendly": friendly_desc,
+                    "details": details,
+                }
+            )
+            if friendly_desc:
+                friendly_msgs.append(friendly_desc)
+            if details:
+                details_msgs.append(details)
+
+        msg_dict["tool_calls"] = tool_calls
+        msg_dict["type"] = "tool_use"
+        if friendly_msgs:
+            msg_dict["friendly"] = friendly_msgs
+        # Include details for slide content
+        if details_msgs:
+            msg_dict["details"] = details_msgs
 
-        for block in message.content:
-            if TextBlock and isinstance(block, TextBlock):
-                texts.append(block.text)
-            elif ToolUseBlock and isinstance(block, ToolUseBlock):
-                tool_name = getattr(block, "name", "unknown")
-                tool_input = getattr(block, "input", {})
-                friendly_desc, details = _get_friendly_tool_description(
-                    tool_name, tool_input
-                )
+    return msg_dict
 
-                tool_calls.append(
-                    {
-                        "name": tool_name,
-                        "input": (
-                            tool_input
-                            if isinstance(tool_input, dict)
-                            else str(tool_input)[:200]
-                        ),
-                        "friendly": friendly_desc,
-                        "details": details,
-                    }
-                )
 
-        if texts:
-            msg_dict["text"] = " ".join(texts)
-        if tool_calls:
-            msg_dict["tool_calls"] = tool_calls
-            msg_dict["type"] = "tool_use"
-            friendly_msgs = [tc["friendly"] for tc in tool_calls if tc.get("friendly")]
-            if friendly_msgs:
-                msg_dict["friendly"] = friendly_msgs
-            # Include details for slide content
-            details_msgs = [tc["details"] for tc in tool_calls if tc.get("details")]
-            if details_msgs:
-                msg_dict["details"] = details_msgs
-
-    elif UserMessage and isinstance(message, UserMessage):
-        msg_dict["type"] = "user"
-        if hasattr(message, "content"):
-            msg_dict["content"] = str(message.content)[:500]
-
-    elif SystemMessage and isinstance(message, SystemMessage):
-        msg_dict["type"] = "system"
-        if hasattr(message, "content"):
-            msg_dict["content"] = str(message.content)[:500]
-
-    elif ResultMessage and isinstance(message, ResultMessage):
-        msg_dict["type"] = "result"
-        # Extract session_id from ResultMessage
-        if hasattr(message, "session_id"):
-            msg_dict["session_id"] = message.session_id
+def _serialize_user(message) -> dict:
+    """Serialize a UserMessage (typically tool results)."""
+    msg_dict = {"type": "user"}
+    if hasattr(message, "content"):
+        msg_dict["content"] = _truncate(message.content, 500)
+    return msg_dict
+
 
+def _serialize_system(message) -> dict:
+    """Serialize a SystemMessage."""
+    msg_dict = {"type": "system"}
+    if hasattr(message, "content"):
+        msg_dict["content"] = _truncate(message.content, 500)
     return msg_dict
 
 
+def _serialize_result(message) -> dict:
+    """Serialize a ResultMessage, keeping the Claude session ID."""
+    msg_dict = {"type": "result"}
+    if hasattr(message, "session_id"):
+        msg_dict["session_id"] = message.session_id
+    return msg_dict
+
+
+# Message type -> serializer (SDK classes are None when unavailable)
+_MESSAGE_SERIALIZERS = {
+    cls: fn
+    for cls, fn in (
+        (AssistantMessage, _serialize_assistant),
+        (UserMessage, _serialize_user),
+        (SystemMessage, _serialize_system),
+        (ResultMessage, _serialize_result),
+    )
+    if cls is not None
+}
+
+
+def _serialize_message(message) -> dict:
+    """Convert an agent message to a JSON-serializable dict."""
+    msg_type = type(message)
+    serialize = _MESSAGE_SERIALIZERS.get(msg_type)
+    if serialize is None:
+        # SDK subclasses (e.g. TaskStartedMessage of SystemMessage) serialize as
+        # their base; remember the match so the next one is a direct hit
+        for base in msg_type.__mro__[1:]:
+            serialize = _MESSAGE_SERIALIZERS.get(base)
+            if serialize is not None:
+                _MESSAGE_SERIALIZERS[msg_type] = serialize
+                break
+        else:
+            return {"type": "unknown"}
+    return serialize(message)
+
+
 # =============================================================================
 # AGENT OPTIONS
 # =============================================================================
 
 
-def _create_agent_options(
-    session: PresentationSession,
-    is_continuation: bool = False,
-    resume_session_id: Optional[str] = None,
-) -> "ClaudeAgentOptions":
-    """Create agent options with presentation tools."""
-    session.is_continuation = is_continuation
-
-    # Create in-process MCP server with our tools
-    pres_server = create_sdk_mcp_server(
-        name="presentation", version="1.0.0", tools=PRESENTATION_TOOLS
-    )
-
+def _build_system_prompt(session: PresentationSession, is_continuation: bool) -> str:
+    """Build the system prompt from the base prompt, context files and template."""
     # Use different system prompt for continuations
     system_prompt = SYSTEM_PROMPT_CONTINUATION if is_continuation else SYSTEM_PROMPT_NEW
 
@@ -813,21 +957,60 @@ def _create_agent_options(
             system_prompt += f"\n\nStyle reference screenshots will be provided as images in the user message. "
             system_prompt += "Carefully analyze these screenshots and replicate the visual style (colors, fonts, layout patterns, design elements) in the slides you create."
 
+    return system_prompt
+
+
+def _system_prompt_inputs(session: PresentationSession) -> tuple:
+    """Return the context file and template content the system prompt is built from."""
+    template = session.style_template or {}
+    return (
+        tuple((f.get("filename"), f.get("text")) for f in session.context_files),
+        template.get("filename"),
+        template.get("text"),
+        len(template.get("screenshots", [])),
+    )
+
+
+def _get_system_prompt(session: PresentationSession, is_continuation: bool) -> str:
+    """Return the session's system prompt, building it only when inputs change.
+
+    The cache is keyed on content rather than identity, because the web client
+    resends the same context files on every turn.
+    """
+    inputs = _system_prompt_inputs(session)
+    cache = session._system_prompt_cache
+    key = (is_continuation, inputs)
+    system_prompt = cache.get(key)
+    if system_prompt is None:
+        # Drop prompts built from older inputs; they will not be asked for again
+        for stale in [k for k in cache if k[1] != inputs]:
+            del cache[stale]
+        system_prompt = _build_system_prompt(session, is_continuation)
+        cache[key] = system_prompt
+    return system_prompt
+
+
+def _create_agent_options(
+    session: PresentationSession,
+    is_continuation: bool = False,
+    resume_session_id: Optional[str] = None,
+) -> "ClaudeAgentOptions":
+    """Create agent options with presentation tools."""
+    session.is_continuation = is_continuation
+
+    # Create the in-process MCP server once per session; its tools are bound
+    # to the session and don't change between turns
+    if session._mcp_server is None:
+        session._mcp_server = create_sdk_mcp_server(
+            name="presentation", version="1.0.0", tools=_build_tools(session)
+        )
+
+    system_prompt = _get_system_prompt(session, is_continuation)
+
     return ClaudeAgentOptions(
         system_prompt=system_prompt,
-        mcp_servers={"presentation": pres_server},
-        allowed_tools=[
-            "mcp__presentation__create_presentation",
-            "mcp__presentation__add_slide",
-            "mcp__presentation__update_slide",
-            "mcp__presentation__delete_slide",
-            "mcp__presentation__reorder_slides",
-            "mcp__presentation__list_slides",
-            "mcp__presentation__get_slide",
-            "mcp__presentation__set_theme",
-            "mcp__presentation__get_pending_edits",
-            "mcp__presentation__commit_edits",
-        ],
+        mcp_servers={"presentation": session._mcp_server},
+        allowed_tools=_ALLOWED_TOOLS,
         resume=resume_session_id,
     )
 
@@ -1128,6 +1311,51 @@ async def _simple_prompt(text: str) -> AsyncGenerator[dict, None]:
     }
 
 
+# Fixed status events, yielded as shared objects; the SSE layer only reads them
+_STATUS_CONNECTING = {"type": "status", "message": "Connecting to Claude Agent SDK..."}
+_STATUS_CONNECTED = {"type": "status", "message": "Agent connected, processing..."}
+_STATUS_RETRYING = {"type": "status", "message": "Retrying slide creation..."}
+
+# Marks the end of a drained SDK response stream
+_STREAM_END = object()
+
+
+async def _drain_response(client: "ClaudeSDKClient", queue: asyncio.Queue) -> None:
+    """Pump SDK response messages into ``queue``, terminated by _STREAM_END."""
+    try:
+        async for message in client.receive_response():
+            await queue.put(message)
+    except Exception:
+        await queue.put(_STREAM_END)
+        raise
+    await queue.put(_STREAM_END)
+
+
+async def _receive_buffered(client: "ClaudeSDKClient") -> AsyncGenerator[Any, None]:
+    """Yield SDK response messages read ahead by a background producer task.
+
+    Reading from the SDK overlaps with the caller's per-message work
+    (logging, serialization, SSE write) instead of alternating with it.
+    Errors raised by the SDK are re-raised once the buffer is drained.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=32)
+    producer = asyncio.create_task(_drain_response(client, queue))
+    try:
+        while True:
+            message = await queue.get()
+            if message is _STREAM_END:
+                break
+            yield message
+        await producer
+    finally:
+        if not producer.done():
+            producer.cancel()
+            try:
+                await producer
+            except asyncio.CancelledError:
+                pass
+
+
 async def run_agent_stream(
     instructions: str,
     is_continuation: bool = False,
@@ -1175,14 +1403,12 @@ async def run_agent_stream(
     if effective_instructions != instructions:
         print(f"[Agent Stream] Instructions pre-processed from multi-quoted format")
 
-    set_current_session(session)
-
     yield {
         "type": "init",
         "message": "Starting agent...",
         "session_id": session.session_id,
     }
-    yield {"type": "status", "message": "Connecting to Claude Agent SDK..."}
+    yield _STATUS_CONNECTING
 
     options = _create_agent_options(session, is_continuation, resume_session_id)
     message_count = 0
@@ -1192,13 +1418,13 @@ async def run_agent_stream(
     try:
         async with ClaudeSDKClient(options=options) as client:
             print(f"[Agent Stream] Connected, sending query...")
-            yield {"type": "status", "message": "Agent connected, processing..."}
+            yield _STATUS_CONNECTED
 
             await client.query(
                 _build_multimodal_prompt(session, effective_instructions)
             )
 
-            async for message in client.receive_response():
+            async for message in _receive_buffered(client):
                 message_count += 1
                 msg_type = type(message).__name__
 
@@ -1234,7 +1460,11 @@ async def run_agent_stream(
         return
 
     finally:
-        set_current_session(None)
+        await _await_pending_save(session)
+
+    # The client has closed; drop it and its options now rather than holding
+    # them for the rest of the stream (retry, final save, complete event)
+    del client, options
 
     # --------------------------------------------------------------------------
     # Automatic retry when agent produced 0 slides (clarification loop guard)
@@ -1254,7 +1484,7 @@ async def run_agent_stream(
             f"Agent produced 0 slides on first run — retrying as continuation. "
             f"agent_session_id={agent_session_id}"
         )
-        yield {"type": "status", "message": "Retrying slide creation..."}
+        yield _STATUS_RETRYING
 
         # Determine minimum required slides from the preprocessed instructions
         # Extract any slide count mentioned in the original request
@@ -1280,14 +1510,13 @@ async def run_agent_stream(
         retry_options = _create_agent_options(
             session, is_continuation=True, resume_session_id=agent_session_id
         )
-        set_current_session(session)
 
         try:
             async with ClaudeSDKClient(options=retry_options) as retry_client:
                 print(f"[Agent Stream] Retry: sending explicit slide-creation prompt")
                 await retry_client.query(_simple_prompt(retry_text))
 
-                async for message in retry_client.receive_response():
+                async for message in _receive_buffered(retry_client):
                     message_count += 1
                     msg_type = type(message).__name__
 
@@ -1322,7 +1551,9 @@ async def run_agent_stream(
             yield {"type": "error", "error": f"Retry agent error: {str(e)}"}
 
         finally:
-            set_current_session(None)
+            await _await_pending_save(session)
+
+        del retry_options
 
     # Save final session state
     session.claude_session_id = agent_session_id
@@ -1,20 +1,258 @@
 #!/usr/bin/env python3
 """
 Test script to verify PPT creation functionality end-to-end.
+
+Runs against a live backend by default. Set TEST_MOCK=1 to replay a canned
+agent stream through httpx.MockTransport instead (no server or API key).
 """
 
 import httpx
-import json
 import asyncio
+import json
+import os
 import sys
+from dataclasses import dataclass, field
+from typing import Optional
+
+# orjson decodes the many small SSE events noticeably faster; fall back to the
+# stdlib when it isn't installed
+try:
+    from orjson import loads as json_loads, JSONDecodeError
+except ImportError:
+    from json import loads as json_loads, JSONDecodeError
 
 API_BASE = "http://localhost:8000"
 
+# Progress output is opt-in (TEST_VERBOSE=1); errors and the final result
+# are always printed
+VERBOSE = os.environ.get("TEST_VERBOSE") == "1"
+
+# SSE data line prefix and the ZIP signature every PPTX file starts with
+_DATA_PREFIX = b"data: "
+_PREFIX_LEN = len(_DATA_PREFIX)
+_PK_MAGIC = b"PK\x03\x04"
+
+# Flattens multi-line text for the one-line progress previews
+_NL_TRANS = str.maketrans({"\n": " ", "\r": " "})
+
+# Canned backend responses replayed when TEST_MOCK=1
+_MOCK_SESSION_ID = "mock-session"
+_MOCK_EVENTS = [
+    {"type": "init", "message": "Starting agent...", "session_id": _MOCK_SESSION_ID},
+    {"type": "status", "message": "Connecting to Claude Agent SDK..."},
+    {
+        "type": "tool_use",
+        "tool_calls": [{"name": "mcp__presentation__create_presentation"}],
+        "friendly": ["Creating presentation: Test Presentation"],
+    },
+    {
+        "type": "tool_use",
+        "tool_calls": [{"name": "mcp__presentation__add_slide"}],
+        "friendly": ["Adding slide: Artificial Intelligence"],
+    },
+    {
+        "type": "tool_use",
+        "tool_calls": [{"name": "mcp__presentation__add_slide"}],
+        "friendly": ["Adding slide: Machine Learning"],
+    },
+    {"type": "assistant", "text": "Created a 2-slide presentation."},
+    {"type": "result", "session_id": "mock-claude-session"},
+    {
+        "type": "complete",
+        "success": True,
+        "session_id": "mock-claude-session",
+        "user_session_id": _MOCK_SESSION_ID,
+        "slide_count": 2,
+    },
+]
+_MOCK_SESSION = {
+    "session_id": _MOCK_SESSION_ID,
+    "presentation": {
+        "title": "Test Presentation",
+        "slides": [
+            {"index": 0, "html": "<h1>Artificial Intelligence</h1>"},
+            {"index": 1, "html": "<h1>Machine Learning</h1>"},
+        ],
+        "theme": {},
+    },
+}
+
+
+def _replay(request: httpx.Request) -> httpx.Response:
+    """Serve the canned backend responses for TEST_MOCK=1 runs."""
+    path = request.url.path
+    if path == "/agent-stream":
+        body = b"".join(
+            _DATA_PREFIX + json.dumps(event).encode() + b"\n\n"
+            for event in _MOCK_EVENTS
+        )
+        return httpx.Response(
+            200, content=body, headers={"content-type": "text/event-stream"}
+        )
+    if path == f"/session/{_MOCK_SESSION_ID}":
+        return httpx.Response(200, json=_MOCK_SESSION)
+    if path == f"/session/{_MOCK_SESSION_ID}/export":
+        return httpx.Response(200, content=_PK_MAGIC + bytes(1024))
+    return httpx.Response(404, json={"detail": "Not found"})
+
+
+def _build_client() -> httpx.AsyncClient:
+    """Create the shared client, backed by the replay transport under TEST_MOCK=1."""
+    if os.environ.get("TEST_MOCK") == "1":
+        return httpx.AsyncClient(
+            base_url=API_BASE, transport=httpx.MockTransport(_replay)
+        )
+    return httpx.AsyncClient(
+        base_url=API_BASE,
+        # Fail fast when the backend is down; only the agent stream needs
+        # a generous read timeout
+        timeout=httpx.Timeout(connect=2.0, read=120.0, write=10.0, pool=2.0),
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+    )
+
+
+# One pooled client for the whole run so the follow-up requests reuse
+# connections instead of opening new ones
+CLIENT = _build_client()
+
+
+async def _iter_sse_data(response: httpx.Response):
+    """Yield the raw ``data:`` payloads of an SSE response as bytes.
+
+    Splits on the blank-line event delimiter, so an event that arrives split
+    across network chunks is reassembled before it is decoded.
+    """
+    buf = bytearray()
+    async for chunk in response.aiter_bytes():
+        buf += chunk
+        while (end := buf.find(b"\n\n")) != -1:
+            event = bytes(buf[:end])
+            del buf[: end + 2]
+            for line in event.split(b"\n"):
+                if line[:_PREFIX_LEN] == _DATA_PREFIX:
+                    yield line[_PREFIX_LEN:]
+
+
+async def _fetch_export(session_id: str) -> tuple[int, int, bytes, str]:
+    """Stream the PPTX export without buffering it in memory.
+
+    Returns (status_code, size_in_bytes, first_4_bytes, error_text).
+    """
+    async with CLIENT.stream("GET", f"/session/{session_id}/export") as response:
+        if response.status_code != 200:
+            await response.aread()
+            return response.status_code, 0, b"", response.text
+
+        size = 0
+        head = b""
+        async for chunk in response.aiter_bytes(chunk_size=65536):
+            if len(head) < len(_PK_MAGIC):
+                head += chunk[: len(_PK_MAGIC) - len(head)]
+            size += len(chunk)
+        return response.status_code, size, head, ""
+
+
+@dataclass
+class _StreamState:
+    """Values collected from the agent SSE stream."""
+
+    user_session_id: Optional[str] = None
+    slide_count: int = 0
+    # Set by the terminal "complete" event; nothing after it is needed
+    done: bool = False
+    # Lines logged while handling one event are written out together
+    lines: list[str] = field(default_factory=list)
+
+    def log(self, line: str):
+        self.lines.append(line)
+
+    def flush(self):
+        if self.lines:
+            sys.stdout.write("\n".join(self.lines) + "\n")
+            sys.stdout.flush()
+            self.lines.clear()
+
+
+def _on_init(data: dict, state: _StreamState):
+    if VERBOSE:
+        state.log(f"   [OK] Agent initialized")
+
+
+def _on_status(data: dict, state: _StreamState):
+    if VERBOSE:
+        state.log(f"   -> {data.get('message')}")
+
+
+def _on_tool_use(data: dict, state: _StreamState):
+    if not VERBOSE:
+        return
+    friendly = data.get("friendly")
+    if not friendly:
+        return
+    for desc in friendly:
+        state.log(f"   [TOOL] {desc}")
+
+
+def _on_assistant(data: dict, state: _StreamState):
+    if not VERBOSE:
+        return
+    text = data.get("text")
+    if not text:
+        return
+    preview = text[:80].translate(_NL_TRANS)
+    state.log(f"   [AGENT] {preview}...")
+
+
+def _on_complete(data: dict, state: _StreamState):
+    uid = data.get("user_session_id")
+    n = data.get("slide_count", 0)
+    state.user_session_id = uid
+    state.slide_count = n
+    state.done = True
+    if VERBOSE:
+        state.log(f"\n   [OK] Agent completed!")
+        state.log(f"   Session ID: {uid}")
+        state.log(f"   Slides created: {n}")
+
+
+def _on_error(data: dict, state: _StreamState):
+    state.log(f"\n   [ERROR] Error: {data.get('error')}")
+    return False
+
+
+# SSE event type -> handler; a handler returning False fails the test
+HANDLERS = {
+    "init": _on_init,
+    "status": _on_status,
+    "tool_use": _on_tool_use,
+    "assistant": _on_assistant,
+    "complete": _on_complete,
+    "error": _on_error,
+}
+
+
+# The backend serializes events with json.dumps, which always writes "type"
+# first; peeking at it lets unhandled events skip JSON decoding entirely
+_TYPE_PREFIX = b'{"type": "'
+# (without VERBOSE only complete/error carry anything the run needs)
+_HANDLED_TYPES = frozenset(
+    t.encode() for t in (HANDLERS if VERBOSE else ("complete", "error"))
+)
+
+
+def _peek_type(payload: bytes) -> Optional[bytes]:
+    """Return the raw event type from an SSE payload, or None if not found."""
+    if not payload.startswith(_TYPE_PREFIX):
+        return None
+    end = payload.find(b'"', len(_TYPE_PREFIX))
+    return payload[len(_TYPE_PREFIX) : end] if end != -1 else None
+
 
 async def test_create_presentation():
     """Test creating a simple presentation via the agent."""
-    print("Testing PPT creation functionality...")
-    print("-" * 50)
+    if VERBOSE:
+        print("Testing PPT creation functionality...")
+        print("-" * 50)
 
     # Prepare form data for agent request
     form_data = {
@@ -22,134 +260,121 @@ async def test_create_presentation():
         "is_continuation": "false",
     }
 
-    print("\n1. Sending request to agent to create presentation...")
+    if VERBOSE:
+        print("\n1. Sending request to agent to create presentation...")
 
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        try:
-            # Make streaming request to agent
-            async with client.stream(
-                "POST", f"{API_BASE}/agent-stream", data=form_data
-            ) as response:
-                if response.status_code != 200:
-                    print(
-                        f"ERROR: Agent request failed with status {response.status_code}"
-                    )
-                    return False
+    try:
+        # Make streaming request to agent
+        async with CLIENT.stream("POST", "/agent-stream", data=form_data) as response:
+            if response.status_code != 200:
+                print(f"ERROR: Agent request failed with status {response.status_code}")
+                return False
 
-                user_session_id = None
-                slide_count = 0
+            state = _StreamState()
 
-                # Process SSE stream
+            # Process SSE stream
+            if VERBOSE:
                 print("\n2. Processing agent stream...")
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        data_str = line[6:]  # Remove "data: " prefix
-                        try:
-                            data = json.loads(data_str)
-                            msg_type = data.get("type")
-
-                            if msg_type == "init":
-                                print(f"   [OK] Agent initialized")
-                            elif msg_type == "status":
-                                print(f"   -> {data.get('message')}")
-                            elif msg_type == "tool_use":
-                                friendly = data.get("friendly", [])
-                                if friendly:
-                                    for desc in friendly:
-                                        print(f"   [TOOL] {desc}")
-                            elif msg_type == "assistant":
-                                text = data.get("text", "")
-                                if text:
-                                    preview = text[:80].replace("\n", " ")
-                                    print(f"   [AGENT] {preview}...")
-                            elif msg_type == "complete":
-                                user_session_id = data.get("user_session_id")
-                                slide_count = data.get("slide_count", 0)
-                                print(f"\n   [OK] Agent completed!")
-                                print(f"   Session ID: {user_session_id}")
-                                print(f"   Slides created: {slide_count}")
-                            elif msg_type == "error":
-                                print(f"\n   [ERROR] Error: {data.get('error')}")
-                                return False
-                        except json.JSONDecodeError as e:
-                            print(
-                                f"   [WARN] Skipping invalid JSON line from agent: {data_str!r} ({e})"
-                            )
-                            continue
-
-                if not user_session_id:
-                    print("ERROR: No session ID received from agent")
-                    return False
-
-                if slide_count == 0:
-                    print("ERROR: No slides were created")
-                    return False
-
-                print(f"\n3. Retrieving session data...")
-                # Get session to verify it exists
-                session_response = await client.get(
-                    f"{API_BASE}/session/{user_session_id}"
-                )
-                if session_response.status_code != 200:
-                    print(
-                        f"ERROR: Could not retrieve session: {session_response.status_code}"
-                    )
-                    return False
-
-                session_data = session_response.json()
-                presentation = session_data.get("presentation")
-                if not presentation:
-                    print("ERROR: No presentation in session")
-                    return False
-
-                print(f"   [OK] Presentation title: {presentation.get('title')}")
-                print(
-                    f"   [OK] Number of slides: {len(presentation.get('slides', []))}"
-                )
-
-                # List slides
-                print(f"\n4. Verifying slides...")
-                for i, slide in enumerate(presentation.get("slides", [])):
-                    preview = slide.get("html", "")[:60].replace("\n", " ")
-                    print(f"   Slide {i+1}: {preview}...")
-
-                # Test export functionality
-                print(f"\n5. Testing PPTX export...")
-                export_response = await client.get(
-                    f"{API_BASE}/session/{user_session_id}/export"
-                )
-                if export_response.status_code != 200:
-                    print(
-                        f"ERROR: Export failed with status {export_response.status_code}"
-                    )
-                    print(f"Response: {export_response.text}")
-                    return False
-
-                pptx_size = len(export_response.content)
-                print(f"   [OK] PPTX exported successfully!")
-                print(f"   File size: {pptx_size:,} bytes")
-
-                # Verify it's a valid PPTX file (starts with PK zip signature)
-                if export_response.content[:4] == b"PK\x03\x04":
-                    print(f"   [OK] Valid PPTX file format confirmed")
-                else:
-                    print(f"   [WARN] Warning: File may not be valid PPTX format")
-
-                print("\n" + "=" * 50)
-                print("[SUCCESS] ALL TESTS PASSED!")
-                print("=" * 50)
-                return True
-
-        except httpx.TimeoutException:
-            print("ERROR: Request timed out")
+            try:
+                async for payload in _iter_sse_data(response):
+                    peeked = _peek_type(payload)
+                    if peeked is not None and peeked not in _HANDLED_TYPES:
+                        continue
+                    try:
+                        data = json_loads(payload)
+                    except JSONDecodeError as e:
+                        state.log(
+                            f"   [WARN] Skipping invalid JSON line from agent: {payload!r} ({e})"
+                        )
+                        state.flush()
+                        continue
+
+                    handler = HANDLERS.get(data.get("type"))
+                    result = handler(data, state) if handler else None
+                    state.flush()
+                    if result is False:
+                        return False
+                    if state.done:
+                        break
+            finally:
+                state.flush()
+
+        # Leaving the stream context closes the connection right after
+        # "complete", so the server can release the agent stream early
+        user_session_id = state.user_session_id
+
+        if not user_session_id:
+            print("ERROR: No session ID received from agent")
+            return False
+
+        if state.slide_count == 0:
+            print("ERROR: No slides were created")
+            return False
+
+        if VERBOSE:
+            print(f"\n3. Retrieving session data...")
+        # Session fetch and PPTX export are independent; issue them together
+        session_response, export_result = await asyncio.gather(
+            CLIENT.get(f"/session/{user_session_id}"),
+            _fetch_export(user_session_id),
+        )
+        if session_response.status_code != 200:
+            print(f"ERROR: Could not retrieve session: {session_response.status_code}")
             return False
-        except Exception as e:
-            print(f"ERROR: {type(e).__name__}: {e}")
-            import traceback
 
-            traceback.print_exc()
+        session_data = session_response.json()
+        presentation = session_data.get("presentation")
+        if not presentation:
+            print("ERROR: No presentation in session")
             return False
 
+        if VERBOSE:
+            print(f"   [OK] Presentation title: {presentation.get('title')}")
+            print(f"   [OK] Number of slides: {len(presentation.get('slides', []))}")
+
+            # List slides
+            print(f"\n4. Verifying slides...")
+            for i, slide in enumerate(presentation.get("slides", [])):
+                preview = slide.get("html", "")[:60].translate(_NL_TRANS)
+                print(f"   Slide {i+1}: {preview}...")
+
+            # Test export functionality
+            print(f"\n5. Testing PPTX export...")
+        export_status, pptx_size, pptx_head, export_error = export_result
+        if export_status != 200:
+            print(f"ERROR: Export failed with status {export_status}")
+            print(f"Response: {export_error}")
+            return False
+
+        if VERBOSE:
+            print(f"   [OK] PPTX exported successfully!")
+            print(f"   File size: {pptx_size:,} bytes")
+
+        # Verify it's a valid PPTX file (starts with PK zip signature)
+        if pptx_head == _PK_MAGIC:
+            if VERBOSE:
+                print(f"   [OK] Valid PPTX file format confirmed")
+        else:
+            print(f"   [WARN] Warning: File may not be valid PPTX format")
+
+        print("\n" + "=" * 50)
+        print("[SUCCESS] ALL TESTS PASSED!")
+        print("=" * 50)
+        return True
+
+    except httpx.TimeoutException:
+        print("ERROR: Request timed out")
+        return False
+    except Exception as e:
+        print(f"ERROR: {type(e).__name__}: {e}")
+        import traceback
+
+        traceback.print_exc()
+        return False
+
+    finally:
+        await CLIENT.aclose()
+
 
 if __name__ == "__main__":
     success = asyncio.run(test_create_presentation())
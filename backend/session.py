@@ -5,6 +5,7 @@ Provides thread-safe session storage with SQLite persistence
 and file system storage for presentation data.
 """
 
+import asyncio
 import json
 import os
 import re
@@ -12,6 +13,7 @@ import sqlite3
 import threading
 import uuid
 import logging
+from collections import deque
 from datetime import datetime
 from typing import Optional
 from pathlib import Path
@@ -39,7 +41,7 @@ class PresentationSession:
     def __init__(self, session_id: Optional[str] = None):
         self.session_id = session_id or str(uuid.uuid4())
         self.presentation: Optional[Presentation] = None
-        self.pending_edits: list[PendingEdit] = []
+        self.pending_edits: deque[PendingEdit] = deque()
         self.applied_edits: list[dict] = []
         self.context_files: list[dict] = []
         self.style_template: Optional[dict] = None  # {filename, text, screenshots}
@@ -47,11 +49,19 @@ class PresentationSession:
         self.claude_session_id: Optional[str] = None
         self.created_at: datetime = datetime.now()
         self.updated_at: datetime = datetime.now()
+        # Serializes pending-edit mutations from concurrently dispatched tools
+        self._pending_lock = asyncio.Lock()
+        # In-process MCP server with tools bound to this session (built lazily)
+        self._mcp_server = None
+        # Background save scheduled by commit_edits, awaited by the agent stream
+        self._save_task: Optional[asyncio.Task] = None
+        # Built system prompts keyed by the content they were built from
+        self._system_prompt_cache: dict[tuple, str] = {}
 
     def reset(self):
         """Full reset - clear everything."""
         self.presentation = None
-        self.pending_edits = []
+        self.pending_edits.clear()
         self.applied_edits = []
         self.context_files = []
         self.style_template = None
@@ -60,7 +70,7 @@ class PresentationSession:
 
     def soft_reset(self):
         """Soft reset - keep presentation, clear pending edits."""
-        self.pending_edits = []
+        self.pending_edits.clear()
         self.updated_at = datetime.now()
 
     def to_dict(self) -> dict:
@@ -68,9 +78,10 @@ class PresentationSession:
         return {
             "session_id": self.session_id,
             "presentation": self.presentation.to_dict() if self.presentation else None,
-            "pending_edits": [e.to_dict() for e in self.pending_edits],
-            "applied_edits": self.applied_edits,
-            "context_files": self.context_files,
+            # Copy first: a background save may run while tools append edits
+            "pending_edits": [e.to_dict() for e in list(self.pending_edits)],
+            "applied_edits": list(self.applied_edits),
+            "context_files": list(self.context_files),
             "style_template": self.style_template,
             "is_continuation": self.is_continuation,
             "claude_session_id": self.claude_session_id,
@@ -84,9 +95,9 @@ class PresentationSession:
         session = cls(session_id=data["session_id"])
         if data.get("presentation"):
             session.presentation = Presentation.from_dict(data["presentation"])
-        session.pending_edits = [
+        session.pending_edits = deque(
             PendingEdit.from_dict(e) for e in data.get("pending_edits", [])
-        ]
+        )
         session.applied_edits = data.get("applied_edits", [])
         session.context_files = data.get("context_files", [])
         session.style_template = data.get("style_template")
@@ -136,16 +147,29 @@ class SessionManager:
             # Create new session
             session = PresentationSession(session_id)
             self._sessions[session.session_id] = session
-            self._save_to_db(session)
+            self._save_to_db(session.to_dict())
             return session
 
     def save_session(self, session: PresentationSession):
         """Save session to disk."""
+        self.write_snapshot(self.snapshot_session(session))
+
+    def snapshot_session(self, session: PresentationSession) -> dict:
+        """Stamp a session and serialize it for write_snapshot().
+
+        Call this where the session is mutated (the event loop) so the snapshot
+        reflects one consistent state; it shares no lists with the session.
+        """
         with self._lock:
             session.updated_at = datetime.now()
             self._sessions[session.session_id] = session
-            self._save_to_disk(session)
-            self._save_to_db(session)
+        return session.to_dict()
+
+    def write_snapshot(self, data: dict):
+        """Write a snapshot from snapshot_session() to JSON and SQLite."""
+        with self._lock:
+            self._save_to_disk(data)
+            self._save_to_db(data)
 
     def load_session(self, session_id: str) -> Optional[PresentationSession]:
         """Load session by ID."""
@@ -172,21 +196,22 @@ class SessionManager:
         except ValueError:
             return None
 
-    def _save_to_disk(self, session: PresentationSession):
-        """Save session data to JSON file."""
-        if not _SESSION_ID_RE.match(session.session_id):
-            raise ValueError(f"Invalid session ID: {session.session_id!r}")
-        session_dir = self._resolve_safe_path(session.session_id)
+    def _save_to_disk(self, data: dict):
+        """Save serialized session data to JSON file."""
+        session_id = data["session_id"]
+        if not _SESSION_ID_RE.match(session_id):
+            raise ValueError(f"Invalid session ID: {session_id!r}")
+        session_dir = self._resolve_safe_path(session_id)
         if session_dir is None:
             raise ValueError(
-                f"Session ID resolves outside data directory: {session.session_id!r}"
+                f"Session ID resolves outside data directory: {session_id!r}"
             )
         session_dir.mkdir(exist_ok=True)
 
         # session_dir verified by _resolve_safe_path() — safe to write
         data_path = session_dir / "session.json"
         with open(data_path, "w", encoding="utf-8") as f:
-            json.dump(session.to_dict(), f, indent=2)
+            json.dump(data, f, indent=2)
 
     def _load_from_disk(self, session_id: str) -> Optional[PresentationSession]:
         """Load session data from JSON file."""
@@ -210,8 +235,8 @@ class SessionManager:
             logger.error("Error loading session %r: %s", session_id, e)
             return None
 
-    def _save_to_db(self, session: PresentationSession):
-        """Save session metadata to SQLite."""
+    def _save_to_db(self, data: dict):
+        """Save serialized session metadata to SQLite."""
         with sqlite3.connect(DB_PATH) as conn:
             conn.execute(
                 """
@@ -220,10 +245,10 @@ class SessionManager:
                 VALUES (?, ?, ?, ?)
             """,
                 (
-                    session.session_id,
-                    session.created_at.isoformat(),
-                    session.updated_at.isoformat(),
-                    session.claude_session_id,
+                    data["session_id"],
+                    data["created_at"],
+                    data["updated_at"],
+                    data["claude_session_id"],
                 ),
             )
             conn.commit()